@@ -1,12 +1,15 @@
 import os
 import sys
-import json
 import time
-from datetime import datetime, timezone
+from concurrent.futures import Future, ThreadPoolExecutor
 
+import msgspec
+import numpy as np
+import orjson
 import pandas as pd
-import yfinance as yf
 import requests
+from numba import njit, types
+from requests.adapters import HTTPAdapter
 
 
 # -----------------------------
@@ -19,6 +22,12 @@ STATE_PATH = os.path.join(DATA_DIR, "state_de40.json")
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
 
+YAHOO_URL = "https://query1.finance.yahoo.com/v8/finance/chart/%5EGDAXI"
+# Full window for a cold EMA200 start; once EMAs are persisted a short
+# window is enough to see the candles closed since the last run.
+COLD_RANGE = "14d"
+WARM_RANGE = "2d"
+
 
 # -----------------------------
 # Boot logs
@@ -30,43 +39,83 @@ print("BOOT: has TELEGRAM_BOT_TOKEN =", bool(TELEGRAM_BOT_TOKEN), flush=True)
 print("BOOT: has TELEGRAM_CHAT_ID =", bool(TELEGRAM_CHAT_ID), flush=True)
 
 
+# -----------------------------
+# HTTP session (keep-alive to Telegram + Yahoo)
+# -----------------------------
+_SESSION = requests.Session()
+_SESSION.headers.update({"User-Agent": "Mozilla/5.0"})
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
+
+
 # -----------------------------
 # Telegram helpers
 # -----------------------------
+# Sends run on a single background thread so a slow Telegram API never
+# stalls the polling loop; messages still go out in submission order.
+_TELEGRAM_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="telegram")
+
+
+def _telegram_post(text: str) -> requests.Response:
+    return _SESSION.post(
+        f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage",
+        data=orjson.dumps({"chat_id": TELEGRAM_CHAT_ID, "text": text}),
+        headers={"Content-Type": "application/json"},
+        timeout=30,
+    )
+
+
+def _telegram_done(future: Future) -> None:
+    try:
+        r = future.result()
+    except Exception as e:
+        print("TELEGRAM: send exception:", e, flush=True)
+        return
+    if r.status_code != 200:
+        print("TELEGRAM: send failed", r.status_code, r.text[:200], flush=True)
+
+
 def telegram_send(text: str) -> None:
     if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
         print("TELEGRAM: missing token/chat_id; cannot send", flush=True)
         return
 
-    try:
-        r = requests.post(
-            f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage",
-            data={"chat_id": TELEGRAM_CHAT_ID, "text": text},
-            timeout=30,
-        )
-        if r.status_code != 200:
-            print("TELEGRAM: send failed", r.status_code, r.text[:200], flush=True)
-    except Exception as e:
-        print("TELEGRAM: send exception:", e, flush=True)
+    future = _TELEGRAM_POOL.submit(_telegram_post, text)
+    future.add_done_callback(_telegram_done)
 
 
 # -----------------------------
 # State (dedupe / last signal)
 # -----------------------------
+# The bot is the only writer of STATE_PATH, so the file is read once and
+# later loads are served from memory; saves still go straight to disk.
+_state_cache: dict | None = None
+
+
 def load_state() -> dict:
-    try:
-        if os.path.exists(STATE_PATH):
-            with open(STATE_PATH, "r", encoding="utf-8") as f:
-                return json.load(f)
-    except Exception as e:
-        print("STATE: load failed:", e, flush=True)
-    return {}
+    global _state_cache
+    if _state_cache is None:
+        _state_cache = {}
+        try:
+            if os.path.exists(STATE_PATH):
+                with open(STATE_PATH, "rb") as f:
+                    _state_cache = orjson.loads(f.read())
+        except Exception as e:
+            print("STATE: load failed:", e, flush=True)
+    return dict(_state_cache)
 
 
 def save_state(state: dict) -> None:
+    global _state_cache
+    _state_cache = dict(state)
+    # Write to a temp file and rename over the old one so a kill mid-write
+    # never leaves a truncated file (and a lost dedupe key) behind
+    tmp_path = STATE_PATH + ".tmp"
     try:
-        with open(STATE_PATH, "w", encoding="utf-8") as f:
-            json.dump(state, f)
+        with open(tmp_path, "wb") as f:
+            f.write(orjson.dumps(state))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, STATE_PATH)
     except Exception as e:
         print("STATE: save failed:", e, flush=True)
 
@@ -74,60 +123,267 @@ def save_state(state: dict) -> None:
 # -----------------------------
 # Indicators
 # -----------------------------
-def ema(series: pd.Series, n: int) -> pd.Series:
-    return series.ewm(span=n, adjust=False).mean()
+# Prices and EMAs are float32 throughout; DAX levels need far less
+# precision than that. The explicit signature compiles at import and takes
+# read-only input, which is what pandas' copy-on-write to_numpy() returns.
+_F32_IN = types.Array(types.float32, 1, "A", readonly=True)
+
+
+# No fastmath: the kernel and ema_step must round identically, so the
+# persisted EMAs don't depend on which path computed them last.
+@njit(types.float32[:, :](_F32_IN, _F32_IN), cache=True)
+def emas(x: np.ndarray, alphas: np.ndarray) -> np.ndarray:
+    # Same recursion as pandas ewm(span=n, adjust=False), all spans in one
+    # pass over x; column j of the result is the EMA for alphas[j]
+    one = np.float32(1.0)
+    out = np.empty((x.size, alphas.size), dtype=np.float32)
+    out[0, :] = x[0]
+    for i in range(1, x.size):
+        for j in range(alphas.size):
+            a = alphas[j]
+            out[i, j] = a * x[i] + (one - a) * out[i - 1, j]
+    return out
+
+
+EMA_SPANS = (20, 50, 200)
+# alpha = 2 / (n + 1) per span, computed once in float32 and shared by
+# emas() and ema_step()
+_EMA_ALPHAS = np.float32(2.0) / (np.array(EMA_SPANS, dtype=np.float32) + np.float32(1.0))
+_EMA_ALPHA = dict(zip(EMA_SPANS, _EMA_ALPHAS))
+
+
+def ema_step(prev: float, x: float, n: int) -> np.float32:
+    a = _EMA_ALPHA[n]
+    return a * np.float32(x) + (np.float32(1.0) - a) * np.float32(prev)
+
+
+def candle_epochs(times: pd.Series) -> np.ndarray:
+    return pd.DatetimeIndex(times).as_unit("s").asi8
+
+
+def ema_resume_index(ema_state: dict | None, epochs: np.ndarray) -> int | None:
+    # Index of the first candle after the persisted EMAs, if their candle is
+    # still in the window (never the newest one, see update_ema_state)
+    if ema_state:
+        hit = np.flatnonzero(epochs[:-1] == ema_state.get("time"))
+        if hit.size:
+            return int(hit[0]) + 1
+    return None
+
+
+def update_ema_state(ema_state: dict | None, close: np.ndarray, epochs: np.ndarray) -> dict:
+    # The persisted EMAs stop one candle short of the newest closed candle,
+    # so the crossover check has the previous candle's values; only the
+    # candles closed since then are applied.
+    end = close.size - 1
+    start = ema_resume_index(ema_state, epochs)
+
+    if start is None:
+        # Cold start or history gap: full recompute over the window
+        last_row = emas(close[:end], _EMA_ALPHAS)[-1]
+        new_state = {f"ema{n}": float(v) for n, v in zip(EMA_SPANS, last_row)}
+    else:
+        values = {n: np.float32(ema_state[f"ema{n}"]) for n in EMA_SPANS}
+        for x in close[start:end]:
+            for n in EMA_SPANS:
+                values[n] = ema_step(values[n], x, n)
+        # Plain floats for the state file; a float32 round-trips exactly
+        new_state = {f"ema{n}": float(v) for n, v in values.items()}
+
+    new_state["time"] = int(epochs[end - 1])
+    return new_state
 
 
 # -----------------------------
 # Data
 # -----------------------------
-def load_dax_h1() -> pd.DataFrame | None:
-    print("DATA: loading DAX H1 from Yahoo Finance", flush=True)
+# Typed view of the v8 chart JSON; everything else in the payload is skipped
+class Quote(msgspec.Struct):
+    open: list[float | None] = []
+    high: list[float | None] = []
+    low: list[float | None] = []
+    close: list[float | None] = []
 
-    df = yf.download("^GDAXI", interval="1h", period="14d", progress=False)
 
-    # Robust flatten
-    if isinstance(df.columns, pd.MultiIndex):
-        df.columns = df.columns.get_level_values(0)
-    df.columns = [c[0] if isinstance(c, tuple) else c for c in df.columns]
+class Indicators(msgspec.Struct):
+    quote: list[Quote] = []
 
-    if df.empty:
+
+class TradingPeriod(msgspec.Struct):
+    start: int
+    end: int
+
+
+class CurrentTradingPeriod(msgspec.Struct):
+    regular: TradingPeriod | None = None
+
+
+class Meta(msgspec.Struct, rename="camel"):
+    # Time of the last trade in this answer
+    regular_market_time: int | None = None
+    current_trading_period: CurrentTradingPeriod | None = None
+
+
+class ChartResult(msgspec.Struct):
+    meta: Meta = msgspec.field(default_factory=Meta)
+    timestamp: list[int] = []
+    indicators: Indicators = msgspec.field(default_factory=Indicators)
+
+
+class Chart(msgspec.Struct):
+    result: list[ChartResult] | None = None
+
+
+class ChartResponse(msgspec.Struct):
+    chart: Chart
+
+
+_chart_decoder = msgspec.json.Decoder(ChartResponse)
+
+
+# Raw responses keyed on (epoch hour, range). Within the hour a download is
+# served again until a newer answer is due (see update_due), so outside
+# trading hours there is one download per hour and range.
+_download_cache: dict[tuple[int, str], bytes] = {}
+
+
+def _download(rng: str) -> bytes:
+    r = _SESSION.get(
+        YAHOO_URL,
+        params={"range": rng, "interval": "60m"},
+        timeout=30,
+    )
+    if r.status_code != 200:
+        raise RuntimeError(f"HTTP {r.status_code}: {r.text[:200]}")
+    return r.content
+
+
+def _decode(content: bytes) -> ChartResult | None:
+    try:
+        result = _chart_decoder.decode(content).chart.result
+    except msgspec.DecodeError as e:
+        print("DATA: unexpected chart payload:", e, flush=True)
+        return None
+    if not result:
+        print("DATA: empty chart result", flush=True)
+        return None
+    if not result[0].timestamp or not result[0].indicators.quote:
         print("DATA: no data received", flush=True)
         return None
+    return result[0]
 
-    df = df.reset_index()
-    df.columns = [c[0] if isinstance(c, tuple) else c for c in df.columns]
-
-    # Normalize column names
-    df.rename(
-        columns={
-            "Datetime": "time",
-            "Date": "time",
-            "Open": "open",
-            "High": "high",
-            "Low": "low",
-            "Close": "close",
-        },
-        inplace=True,
-    )
 
-    # Keep only core columns
-    needed = ["time", "open", "high", "low", "close"]
-    for col in needed:
-        if col not in df.columns:
-            print("DATA: missing column:", col, "available:", list(df.columns), flush=True)
-            return None
+def fetch_data(rng: str, now: float) -> ChartResult | None:
+    bucket = int(now) // 3600
+    key = (bucket, rng)
+    content = _download_cache.get(key)
+    if content is not None:
+        res = _decode(content)
+        if res is not None and not update_due(res, now):
+            return res
+        print("DATA: newer data due, fetching again", flush=True)
+
+    try:
+        content = _download(rng)
+    except Exception as e:
+        print("DATA: request failed:", e, flush=True)
+        return None
+
+    # A download is only cached once it has passed these checks, so an
+    # empty or broken answer is fetched again on the next poll
+    res = _decode(content)
+    if res is None:
+        return None
 
-    df = df[needed].copy()
-    df = df.dropna().sort_values("time").reset_index(drop=True)
+    # Entries from earlier hours can never be hit again
+    for old in [k for k in _download_cache if k[0] != bucket]:
+        del _download_cache[old]
+    _download_cache[key] = content
+    return res
+
+
+def _regular_session(res: ChartResult) -> TradingPeriod | None:
+    period = res.meta.current_trading_period
+    return period.regular if period is not None else None
+
+
+def candle_end(res: ChartResult, t: int) -> int:
+    # An H1 candle ends after its hour or at the close of its session
+    end = t + 3600
+    session = _regular_session(res)
+    if session is not None and session.start <= t < session.end:
+        end = min(end, session.end)
+    return end
+
+
+def candle_is_final(res: ChartResult, t: int) -> bool:
+    # Final once the answer carries a trade at or after the candle's end
+    # (the session close included), or the candle is from an earlier session.
+    # Decided on the payload, not the clock: a late feed still has the
+    # candle's last minutes to publish after its hour is over.
+    session = _regular_session(res)
+    if session is not None and t < session.start:
+        return True
+    last_trade = res.meta.regular_market_time
+    return last_trade is not None and last_trade >= candle_end(res, t)
+
+
+def update_due(res: ChartResult, now: float) -> bool:
+    # Whether Yahoo may have something newer than this answer by now
+    t = res.timestamp[-1]
+    if not candle_is_final(res, t):
+        # Forming or published late: due once the candle should have ended
+        return now >= candle_end(res, t)
+    # Newest candle confirmed: the next one is due while the session runs.
+    # Outside the session nothing changes, so the download is kept.
+    session = _regular_session(res)
+    return session is not None and session.start <= now < session.end
+
+
+def load_dax_h1(rng: str = COLD_RANGE) -> pd.DataFrame | None:
+    # Returns closed candles only, oldest first
+    now = time.time()
+    bucket = int(now) // 3600
+    print(f"DATA: loading DAX H1 ({rng}) from Yahoo Finance", flush=True)
+
+    res = fetch_data(rng, now)
+    if res is None:
+        return None
 
-    # Ensure numeric
-    df["open"] = df["open"].astype(float)
-    df["high"] = df["high"].astype(float)
-    df["low"] = df["low"].astype(float)
-    df["close"] = df["close"].astype(float)
+    ts = res.timestamp
+    # Columnar build straight from the JSON arrays; null prices become NaN
+    # and those candles are masked out. Yahoo returns timestamps ascending.
+    q = res.indicators.quote[0]
+    o = np.asarray(q.open, dtype=np.float32)
+    h = np.asarray(q.high, dtype=np.float32)
+    l = np.asarray(q.low, dtype=np.float32)
+    c = np.asarray(q.close, dtype=np.float32)
+    mask = ~(np.isnan(o) | np.isnan(h) | np.isnan(l) | np.isnan(c))
+
+    df = pd.DataFrame(
+        {
+            "time": pd.to_datetime(np.asarray(ts, dtype=np.int64)[mask], unit="s", utc=True),
+            "open": o[mask],
+            "high": h[mask],
+            "low": l[mask],
+            "close": c[mask],
+        }
+    )
+    if df.empty:
+        # Only null prices: don't serve this download again
+        print("DATA: no complete candles received", flush=True)
+        _download_cache.pop((bucket, rng), None)
+        return None
+
+    # Only the newest candle can be unconfirmed; signals and last_bar_ts
+    # wait until its close is final
+    if not candle_is_final(res, int(df["time"].iat[-1].timestamp())):
+        df = df.iloc[:-1]
+    if df.empty:
+        print("DATA: no closed candles received", flush=True)
+        return None
 
-    print(f"DATA: loaded {len(df)} candles, last time = {df.iloc[-1]['time']}", flush=True)
+    print(f"DATA: loaded {len(df)} closed candles, last time = {df['time'].iat[-1]}", flush=True)
     return df
 
 
@@ -135,59 +391,83 @@ def load_dax_h1() -> pd.DataFrame | None:
 # Strategy / Main loop
 # -----------------------------
 def check_signals_once() -> None:
-    df = load_dax_h1()
+    state = load_state()
+    df = load_dax_h1(WARM_RANGE if state.get("ema") else COLD_RANGE)
     if df is None:
         return
 
-    # Need enough candles for EMA200
-    if len(df) < 210:
+    # Nothing to evaluate until another candle has closed; each closed
+    # candle is judged once, on its final values
+    last_bar_ts = int(df["time"].iat[-1].timestamp())
+    if state.get("last_bar_ts") == last_bar_ts:
+        print("STATUS: no new closed candle since last check", flush=True)
+        return
+
+    epochs = candle_epochs(df["time"])
+    if state.get("ema") and ema_resume_index(state["ema"], epochs) is None:
+        # Persisted EMAs are older than the short window (e.g. after downtime)
+        print("STATUS: EMA state not in recent candles; reloading full history", flush=True)
+        df = load_dax_h1(COLD_RANGE)
+        if df is None:
+            return
+        epochs = candle_epochs(df["time"])
+
+    # Need enough candles for EMA200 when recomputing from scratch
+    if ema_resume_index(state.get("ema"), epochs) is None and len(df) < 210:
         print(f"STATUS: not enough candles for EMA200 (have {len(df)})", flush=True)
         return
 
-    df["ema20"] = ema(df["close"], 20)
-    df["ema50"] = ema(df["close"], 50)
-    df["ema200"] = ema(df["close"], 200)
+    close = df["close"].to_numpy(dtype=np.float32)
+    ema_state = update_ema_state(state.get("ema"), close, epochs)
 
-    # Use dicts to avoid pandas Series comparison issues
-    prev = df.iloc[-2].to_dict()
-    last = df.iloc[-1].to_dict()
+    state["ema"] = ema_state
+    state["last_bar_ts"] = last_bar_ts
 
-    # Basic crossover + trend filter (as in your condition)
-    long_signal = (
-        last["close"] > last["ema200"]
-        and prev["ema20"] <= prev["ema50"]
-        and last["ema20"] > last["ema50"]
-    )
+    # float32 scalars for the last two candles
+    c_last = df["close"].iat[-1]
+    e20_prev = ema_state["ema20"]
+    e50_prev = ema_state["ema50"]
+    e200_last = ema_step(ema_state["ema200"], c_last, 200)
 
-    short_signal = (
-        last["close"] < last["ema200"]
-        and prev["ema20"] >= prev["ema50"]
-        and last["ema20"] < last["ema50"]
-    )
+    # Basic crossover + trend filter (as in your condition), cheapest parts
+    # first: the trend filter leaves at most one direction and the previous
+    # candle's EMA order must allow a cross before EMA20/50 are stepped
+    long_setup = c_last > e200_last and e20_prev <= e50_prev
+    short_setup = c_last < e200_last and e20_prev >= e50_prev
+    if not (long_setup or short_setup):
+        print("STATUS: no signal this candle", flush=True)
+        save_state(state)
+        return
+
+    e20_last = ema_step(e20_prev, c_last, 20)
+    e50_last = ema_step(e50_prev, c_last, 50)
+    long_signal = long_setup and e20_last > e50_last
+    short_signal = short_setup and e20_last < e50_last
 
-    state = load_state()
     last_sent_key = state.get("last_sent_key")
 
-    # Create a unique key per candle to prevent duplicates
-    candle_time = last["time"]
-    # Convert to string safely
-    candle_time_str = str(candle_time)
+    # Readable candle time for the message only; dedupe uses the epoch
+    candle_time_str = str(df["time"].iat[-1])
     signal_type = "LONG" if long_signal else ("SHORT" if short_signal else None)
 
     if signal_type is None:
         print("STATUS: no signal this candle", flush=True)
+        save_state(state)
         return
 
-    sent_key = f"{signal_type}:{candle_time_str}"
+    # Unique key per candle to prevent duplicates; the epoch second does not
+    # depend on how pandas formats timestamps
+    sent_key = f"{signal_type}:{last_bar_ts}"
     if sent_key == last_sent_key:
         print("STATUS: signal already sent for this candle", sent_key, flush=True)
+        save_state(state)
         return
 
     msg = (
         f"DE40 Signal: {signal_type}\n"
         f"Time (candle): {candle_time_str}\n"
-        f"Close: {last['close']:.2f}\n"
-        f"EMA20: {last['ema20']:.2f} | EMA50: {last['ema50']:.2f} | EMA200: {last['ema200']:.2f}"
+        f"Close: {c_last:.2f}\n"
+        f"EMA20: {e20_last:.2f} | EMA50: {e50_last:.2f} | EMA200: {e200_last:.2f}"
     )
     telegram_send(msg)
 
@@ -201,6 +481,10 @@ def main() -> None:
 
     # Check every 5 minutes; strategy dedupes by candle time
     # (H1 candle will only trigger once due to last_sent_key)
+    # Wakeups follow fixed monotonic deadlines so the work time doesn't
+    # add drift; if a check overran a whole period, resync instead of
+    # firing the missed ticks back to back.
+    deadline = time.monotonic()
     while True:
         try:
             check_signals_once()
@@ -208,7 +492,11 @@ def main() -> None:
             print("ERROR: main loop exception:", e, flush=True)
 
         print("HEARTBEAT: alive", flush=True)
-        time.sleep(300)
+        deadline += 300
+        now = time.monotonic()
+        if deadline < now:
+            deadline = now
+        time.sleep(deadline - now)
 
 
 if __name__ == "__main__":